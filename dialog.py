@@ -1,9 +1,12 @@
 import yaml
 import time
+import threading
 import telebot
 import random
 import pymorphy2
 from urllib.parse import urlparse
+from geo import PlacesIndex
+from export import export_sessions
 
 
 def is_url(url: str):
@@ -199,6 +202,29 @@ class AbsNode(object):
 
         self._dialog.save_tags(self._message.chat.id, tags)
 
+    def save_answer(self, answer, data=None):
+        '''
+        Сохраняет то, что ответил пользователь, в поле сессии, указанное в ответе ноды (save)
+        :param answer: ответ ноды
+        :param data: код кнопки, которую пользователь нажал
+        :return:
+        '''
+
+        if 'save' not in answer:
+            return
+
+        message = self._message
+
+        # нажатая кнопка -- сохраняем ее текст, локация -- координаты, иначе текст пользователя
+        if data is not None:
+            value = answer.get('name', '')
+        elif message.content_type == 'location':
+            value = '{:.6f},{:.6f}'.format(message.location.latitude, message.location.longitude)
+        else:
+            value = message.text or ''
+
+        self._dialog.save_answer(message.chat.id, answer['save'], value, limit=answer.get('limit', None))
+
     def get_tags(self):
         '''
         Возвращает все теги сессии пользователя
@@ -250,16 +276,19 @@ class AbsNode(object):
             if data is None and message.content_type == 'text' and 'words' in a:
                 if self.match_words(words=a['words']):
                     self.save_tags(a)
+                    self.save_answer(a, data)
                     return a['goto']
 
             # если нажали на пнопку
             if data is not None and i == int(data):
                 self.save_tags(a)
+                self.save_answer(a, data)
                 return a['goto']
 
             # если прислали некий тип данных, указанный в ответах (например, локация)
             if 'type' in a and a['type'] == message.content_type:
                 self.save_tags(a)
+                self.save_answer(a, data)
                 return a['goto']
 
         return None
@@ -346,19 +375,64 @@ class VariantNode(AbsNode):
 
 class LocationNode(AbsNode):
     '''
-    Здесь будет логика, специфичная геолокации
+    Нода геолокации: если пользователь прислал локацию, рассказываем ему о ближайших местах
     '''
-    pass
+
+    def _say_nearest(self):
+        '''
+        Сказать, какие места из словаря мест ближе всего к пользователю
+        :return:
+        '''
+
+        message = self._message
+        places = self._dialog.places
+
+        if places is None:
+            return
+
+        nearest = places.nearest(message.location.latitude,
+                                 message.location.longitude,
+                                 k=self._config.get('nearest', 3),
+                                 radius=self._config.get('radius', self._dialog.places_radius))
+
+        # рядом ничего нет -- говорим об этом, если в ноде есть такая фраза, иначе молчим
+        if len(nearest) == 0:
+            phrase = self._get_phrase(the_key='far')
+            if phrase is not None:
+                self._dialog.bot.send_message(message.chat.id, phrase)
+            return
+
+        lines = [self._get_phrase(the_key='near') or 'Рядом с тобой:']
+        for place in nearest:
+            kind = ' ({})'.format(place['kind']) if place['kind'] else ''
+            lines.append('{}{} -- {:.1f} км'.format(place['name'], kind, place['distance'] / 1000))
+
+        self._dialog.bot.send_message(message.chat.id, '\n'.join(lines))
+
+    def check_answer(self, data):
+        '''
+        Проверить ответ пользователя, и если это локация, то сначала показать ближайшие места
+        :param data: код кнопки, которую пользователь нажал
+        :return: следующая нода или None
+        '''
+
+        next_node = super().check_answer(data)
+
+        if next_node is not None and data is None and self._message.content_type == 'location':
+            self._say_nearest()
+
+        return next_node
 
 
 class DialogSession(object):
     '''
     Этот класс реализует объект сессии, потом он у нас отправится в базу данных
     и сессия будет переключаться именно там
-    Состоит из текущей ноды, временной метки начала чата, переменных данного чата и идентификатора чата
+    Состоит из текущей ноды, временной метки начала чата, переменных данного чата,
+    сохраненных ответов пользователя и идентификатора чата
     '''
 
-    __slots__ = ['node_name', 'ts', 'tags', 'chat_id']
+    __slots__ = ['node_name', 'ts', 'tags', 'answers', 'chat_id']
 
     def __init__(self, **kwargs) -> None:
         super().__init__()
@@ -404,9 +478,25 @@ class Dialog(object):
         self._config = config.copy()
         self._voc = self._load_voc()
         self._variables = self._get_voc_tags()
+        self._fields = self._get_voc_fields()
+
+        # сколько символов ответов пользователя храним в одной сессии, не больше,
+        # и сколько по умолчанию в одном поле, чтобы длинный ответ не съел место остальных
+        self._answers_limit = self._voc.get('answers_limit', 4096)
+        self._field_limit = self._answers_limit // max(len(self._fields), 1)
 
-        # это пользовательские сессии
+        # это индекс мест для ноды геолокации, строим его один раз на всех
+        self._places, self._places_radius = self._load_places()
+
+        # это пользовательские сессии, идентификаторы чатов в порядке появления (сессии не удаляются,
+        # так что выгрузка может идти по ним страницами) и блокировка, под которой сессии меняются
         self._sessions = self._load_sessions()
+        self._chat_ids = list(self._sessions)
+        self._lock = threading.RLock()
+
+        # кто может выгружать результаты опроса командой /export, и идет ли выгрузка прямо сейчас
+        self._admins = set(self._config.get('admins', []))
+        self._exporting = threading.Lock()
 
         # здесь мы определяем ноду по умолчанию, с которой будем начинать
         # и на которую будем переходить в случае ошибки диалога
@@ -431,28 +521,69 @@ class Dialog(object):
     def variables(self):
         return self._variables
 
-    def _get_voc_tags(self):
+    @property
+    def places(self):
+        return self._places
+
+    @property
+    def places_radius(self):
+        return self._places_radius
+
+    @property
+    def fields(self):
+        return self._fields
+
+    def _iter_voc_answers(self):
         '''
-        Возвращает в качестве "переменных" диалога все возможные имена тэгов
-        :return:
+        Перебирает ответы всех нод словаря диалогов
+        :return: генератор ответов
         '''
-        variables = set()
         for node_name, node in self._voc['nodes'].items():
             answers = node.get('a', [])
 
             if not isinstance(answers, list):
                 answers = [answers]
 
-            for a in answers:
-                tags = a.get('tags', [])
+            yield from answers
 
-                if not isinstance(tags, list):
-                    tags = [tags]
+    def _get_voc_tags(self):
+        '''
+        Возвращает в качестве "переменных" диалога все возможные имена тэгов
+        :return:
+        '''
+        variables = set()
+        for a in self._iter_voc_answers():
+            tags = a.get('tags', [])
+
+            if not isinstance(tags, list):
+                tags = [tags]
 
-                variables.update(tags)
+            variables.update(tags)
 
         return variables
 
+    def _get_voc_fields(self):
+        '''
+        Возвращает имена всех полей, в которые ответы нод сохраняют слова пользователя, в порядке появления.
+        Имена полей не должны совпадать с тегами и полями сессии, иначе в выгрузке они перетрут друг друга
+        :return:
+        '''
+        fields = list()
+        for a in self._iter_voc_answers():
+            if 'save' not in a or a['save'] in fields:
+                continue
+
+            if a['save'] in self._variables or a['save'] in DialogSession.__slots__:
+                raise ValueError('Answer field {} clashes with a tag or a session field'.format(a['save']))
+
+            fields.append(a['save'])
+
+        clashes = self._variables.intersection(DialogSession.__slots__)
+        if clashes:
+            raise ValueError('Tags {} clash with session fields'.format(', '.join(sorted(clashes))))
+
+        return fields
+
 
     def _load_sessions(self):
         '''
@@ -462,6 +593,23 @@ class Dialog(object):
 
         return dict()
 
+    def _load_places(self):
+        '''
+        Загружает места (поликлиники, парки, экстренные службы) из файла, указанного в словаре диалогов
+        :return: индекс мест (или None, если места не указаны) и радиус поиска по умолчанию в метрах
+        '''
+
+        places = self._voc.get('places', None)
+
+        if places is None:
+            return None, None
+
+        if not isinstance(places, dict):
+            places = {'file': places}
+
+        index = PlacesIndex.load(places['file'], leaf_size=places.get('leaf_size', 32))
+        return index, places.get('radius', None)
+
     def _load_voc(self):
         '''
         Загружает словарь диалогов
@@ -480,20 +628,54 @@ class Dialog(object):
 
         return self._sessions.get(chat_id, None)
 
-    def new_session(self, chat_id, node_name=None, tags=None):
+    def new_session(self, chat_id, node_name=None, tags=None, answers=None):
         '''
         Создает новую сессию
         :param chat_id:
         :param node_name:
         :param tags:
+        :param answers:
         :return:
         '''
-        self._sessions[chat_id] = DialogSession(
-            node_name=node_name,
-            ts=time.time(),
-            chat_id=chat_id,
-            tags=tags if tags is not None else dict()
-        )
+        with self._lock:
+            if chat_id not in self._sessions:
+                self._chat_ids.append(chat_id)
+
+            self._sessions[chat_id] = DialogSession(
+                node_name=node_name,
+                ts=time.time(),
+                chat_id=chat_id,
+                tags=tags if tags is not None else dict(),
+                answers=answers if answers is not None else dict()
+            )
+
+    def iter_sessions(self, chunk_size=1000):
+        '''
+        Отдает все сессии пачками в виде словарей, не останавливая диалоги:
+        идем страницами по списку идентификаторов чатов и копируем под блокировкой
+        только одну пачку за раз, так что сверх самих сессий память не растет.
+        Чаты, появившиеся во время выгрузки, тоже попадут в нее
+        :param chunk_size: размер пачки
+        :return: генератор списков словарей сессий
+        '''
+
+        position = 0
+
+        while True:
+            with self._lock:
+                chat_ids = self._chat_ids[position:position + chunk_size]
+                chunk = list()
+                for chat_id in chat_ids:
+                    item = self._sessions[chat_id].to_dict()
+                    item['tags'] = dict(item['tags'] or {})
+                    item['answers'] = dict(item['answers'] or {})
+                    chunk.append(item)
+
+            if len(chat_ids) == 0:
+                return
+
+            position += len(chat_ids)
+            yield chunk
 
     def get_tags(self, chat_id):
         '''
@@ -523,21 +705,51 @@ class Dialog(object):
         :return:
         '''
 
-        if chat_id not in self._sessions:
-            self.new_session(chat_id)
-            sess_tags = {}
-        else:
-            sess_tags = self._sessions[chat_id].tags
+        with self._lock:
+            if chat_id not in self._sessions:
+                self.new_session(chat_id)
+                sess_tags = {}
+            else:
+                sess_tags = self._sessions[chat_id].tags
+
+            if sess_tags is None:
+                sess_tags = dict()
+
+            sess_tags.update({
+                t: sess_tags[t] + 1 if t in sess_tags else 1
+                for t in tags
+            })
+
+            self._sessions[chat_id].set(tags=sess_tags)
+
+    def save_answer(self, chat_id, field, value, limit=None):
+        '''
+        Сохраняет ответ пользователя в поле сессии, обрезая его до лимита поля
+        (по умолчанию answers_limit, поделенный поровну между полями), и так,
+        чтобы все ответы сессии вместе не превышали answers_limit символов
+        :param chat_id:
+        :param field: имя поля
+        :param value: ответ пользователя
+        :param limit: лимит поля, если он указан в ответе ноды
+        :return:
+        '''
+
+        if limit is None:
+            limit = self._field_limit
+
+        with self._lock:
+            if chat_id not in self._sessions:
+                self.new_session(chat_id)
+
+            answers = self._sessions[chat_id].answers
 
-        if sess_tags is None:
-            sess_tags = dict()
+            if answers is None:
+                answers = dict()
 
-        sess_tags.update({
-            t: sess_tags[t] + 1 if t in sess_tags else 1
-            for t in tags
-        })
+            used = sum(len(v) for f, v in answers.items() if f != field)
+            answers[field] = str(value)[:max(min(limit, self._answers_limit - used), 0)]
 
-        self._sessions[chat_id].set(tags=sess_tags)
+            self._sessions[chat_id].set(answers=answers)
 
     def _play_node(self, message, node_name):
         '''
@@ -550,16 +762,17 @@ class Dialog(object):
         node = AbsNode.fabric(self, message, node_name)
         node.say()
 
-        if message.chat.id not in self._sessions:
-            self.new_session(
-                chat_id=message.chat.id,
-                node_name=node_name
-            )
-        else:
-            self._sessions[message.chat.id].set(node_name=node_name)
+        with self._lock:
+            if message.chat.id not in self._sessions:
+                self.new_session(
+                    chat_id=message.chat.id,
+                    node_name=node_name
+                )
+            else:
+                self._sessions[message.chat.id].set(node_name=node_name)
 
-        if node.is_reset:
-            self._sessions[message.chat.id].set(tags=None)
+            if node.is_reset:
+                self._sessions[message.chat.id].set(tags=None, answers=None)
 
     def _dialog(self, message, data=None):
         '''
@@ -607,12 +820,59 @@ class Dialog(object):
             # отыгрываем текущую ноду еще раз
             self._play_node(message, self._default_node)
 
+    def _run_export(self, chat_id, file_name):
+        '''
+        Выгружает сессии в файл и отправляет его в чат; работает в отдельном потоке
+        :param chat_id: идентификатор чата администратора
+        :param file_name: имя файла выгрузки
+        :return: ничего
+        '''
+
+        try:
+            count = export_sessions(self, file_name)
+
+            with open(file_name, 'rb') as f:
+                self._bot.send_document(chat_id, f, caption='Сессий выгружено: {}'.format(count))
+
+        except Exception as e:
+            import traceback
+
+            print(e)
+            print(traceback.format_exc())
+
+            self._bot.send_message(chat_id, 'Не получилось выгрузить результаты: {}'.format(e))
+
+        finally:
+            self._exporting.release()
+
+    def _export(self, message):
+        '''
+        Запускает выгрузку результатов опроса в фоне, чтобы не держать обработчик сообщений.
+        "/export jsonl" выгружает в JSON Lines, иначе в CSV
+        :param message: сообщение pyTelegramBot с командой
+        :return: ничего
+        '''
+
+        if not self._exporting.acquire(blocking=False):
+            self._bot.send_message(message.chat.id, 'Выгрузка уже идет, подожди немного')
+            return
+
+        fmt = 'jsonl' if 'jsonl' in message.text.split()[1:] else 'csv'
+        file_name = '{}.{}'.format(self._config.get('export', 'results'), fmt)
+
+        threading.Thread(target=self._run_export, args=(message.chat.id, file_name), daemon=True).start()
+
     def _attach_handlers(self):
         '''
         Добавляет нашу реакцию (ведение диалога) на события чат-бота
         :return:
         '''
 
+        # выгрузка результатов, только для администраторов; у остальных /export -- обычный текст
+        @self._bot.message_handler(commands=['export'], func=lambda message: message.chat.id in self._admins)
+        def export_handler(message):
+            self._export(message)
+
         # реакция на текстовые сообщения
         @self._bot.message_handler(content_types=['text', 'location'])
         def text_handler(message):
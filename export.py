@@ -0,0 +1,118 @@
+import re
+import csv
+import json
+
+# с этих символов электронные таблицы начинают формулу
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# просто число или пара координат, например "-33.750000,151.200000" -- это не формула
+PLAIN_NUMBERS = re.compile(r'^-?\d+(\.\d+)?(,-?\d+(\.\d+)?)?$')
+
+
+def _columns(dialog):
+    '''
+    Колонки выгрузки: служебные поля сессии, все теги и все сохраняемые ответы из словаря диалогов
+
+    :param dialog: объект диалога
+    :return: список имен колонок
+    '''
+
+    return ['chat_id', 'node_name', 'ts'] + sorted(dialog.variables) + list(dialog.fields)
+
+
+def _record(dialog, sess):
+    '''
+    Приводит сессию к единому виду для всех форматов: все теги (ненаступившие -- нулями)
+    и все поля ответов (не заполненные -- пустыми строками)
+
+    :param dialog: объект диалога
+    :param sess: сессия в виде словаря
+    :return: запись выгрузки
+    '''
+
+    return {
+        'chat_id': sess['chat_id'],
+        'node_name': sess['node_name'],
+        'ts': sess['ts'],
+        'tags': {v: sess['tags'].get(v, 0) for v in sorted(dialog.variables)},
+        'answers': {f: sess['answers'].get(f, '') for f in dialog.fields},
+    }
+
+
+def _escape_formula(value):
+    '''
+    Обезвреживает текст пользователя, который таблица иначе выполнила бы как формулу
+    :param value: значение ячейки
+    :return: безопасное значение
+    '''
+
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) and not PLAIN_NUMBERS.match(value):
+        return "'" + value
+    return value
+
+
+def _write_csv(dialog, f, chunk_size):
+    '''
+    Пишет сессии в CSV, одна строка на сессию
+    :param dialog: объект диалога
+    :param f: открытый файл
+    :param chunk_size: размер пачки
+    :return: количество выгруженных сессий
+    '''
+
+    writer = csv.DictWriter(f, fieldnames=_columns(dialog))
+    writer.writeheader()
+
+    count = 0
+    for chunk in dialog.iter_sessions(chunk_size=chunk_size):
+        rows = list()
+        for sess in chunk:
+            record = _record(dialog, sess)
+            row = {
+                'chat_id': record['chat_id'],
+                'node_name': _escape_formula(record['node_name']),
+                'ts': record['ts'],
+            }
+            row.update(record['tags'])
+            row.update({f: _escape_formula(v) for f, v in record['answers'].items()})
+            rows.append(row)
+
+        writer.writerows(rows)
+        count += len(rows)
+
+    return count
+
+
+def _write_jsonl(dialog, f, chunk_size):
+    '''
+    Пишет сессии в JSON Lines, один объект на строку
+    :param dialog: объект диалога
+    :param f: открытый файл
+    :param chunk_size: размер пачки
+    :return: количество выгруженных сессий
+    '''
+
+    count = 0
+    for chunk in dialog.iter_sessions(chunk_size=chunk_size):
+        f.writelines(json.dumps(_record(dialog, sess), ensure_ascii=False) + '\n' for sess in chunk)
+        count += len(chunk)
+
+    return count
+
+
+def export_sessions(dialog, file_name, chunk_size=1000):
+    '''
+    Выгружает результаты опроса (теги и ответы всех сессий) в CSV или JSONL, в зависимости от расширения файла.
+    Сессии читаются и пишутся пачками, так что память не растет с числом сессий, а диалоги не останавливаются
+
+    :param dialog: объект диалога
+    :param file_name: имя файла, .jsonl -- JSON Lines, иначе CSV
+    :param chunk_size: размер пачки
+    :return: количество выгруженных сессий
+    '''
+
+    with open(file_name, 'w', encoding='utf-8', newline='') as f:
+        if file_name.lower().endswith('.jsonl'):
+            return _write_jsonl(dialog, f, chunk_size)
+
+        return _write_csv(dialog, f, chunk_size)
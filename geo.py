@@ -0,0 +1,333 @@
+import csv
+import json
+import math
+import heapq
+import numpy as np
+
+# средний радиус Земли в метрах
+EARTH_RADIUS = 6371008.8
+
+
+def haversine(lat, lon, lats, lons):
+    '''
+    Векторизованная формула гаверсинусов: расстояние от точки до массива точек
+
+    :param lat: широта точки в радианах
+    :param lon: долгота точки в радианах
+    :param lats: массив широт в радианах
+    :param lons: массив долгот в радианах
+    :return: массив расстояний в метрах
+    '''
+
+    dlat = lats - lat
+    dlon = lons - lon
+    h = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def _angle(a, b):
+    '''
+    Угол между двумя векторами, через atan2 -- точнее, чем арккосинус, на малых углах
+    :param a: вектор (x, y, z)
+    :param b: вектор (x, y, z)
+    :return: угол в радианах
+    '''
+
+    cx = a[1] * b[2] - a[2] * b[1]
+    cy = a[2] * b[0] - a[0] * b[2]
+    cz = a[0] * b[1] - a[1] * b[0]
+    return math.atan2(math.sqrt(cx * cx + cy * cy + cz * cz), a[0] * b[0] + a[1] * b[1] + a[2] * b[2])
+
+
+def _parse_point(place):
+    '''
+    Достает из места координаты, проверяя, что это числа в допустимых пределах
+    :param place: словарь места
+    :return: пара (широта, долгота) в градусах или None, если координаты битые
+    '''
+
+    try:
+        lat = float(place['lat'])
+        lon = float(place['lon'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    if not (math.isfinite(lat) and math.isfinite(lon)) or abs(lat) > 90 or abs(lon) > 180:
+        return None
+
+    return lat, lon
+
+
+def _to_xyz(lats, lons):
+    '''
+    Переводит координаты в радианах в точки на единичной сфере
+    :param lats: широты
+    :param lons: долготы
+    :return: массив (N, 3)
+    '''
+
+    cos_lat = np.cos(lats)
+    return np.stack([cos_lat * np.cos(lons), cos_lat * np.sin(lons), np.sin(lats)], axis=-1)
+
+
+class PlacesIndex(object):
+    '''
+    Пространственный индекс мест (поликлиники, парки, экстренные службы).
+
+    Точки переводятся на единичную сферу и раскладываются в KD-дерево. Каждый узел
+    описан "шапочкой" на сфере: направлением центра и угловым радиусом, так что ветки,
+    заведомо дальше уже найденных k мест, отсекаются, а метры досчитываются
+    гаверсинусами только для найденных.
+    Индекс строится один раз при загрузке и общий для всех сессий.
+    '''
+
+    def __init__(self, places, leaf_size=32) -> None:
+        '''
+        Конструктор индекса
+        :param places: список словарей с ключами name, lat, lon и, возможно, kind
+        :param leaf_size: сколько точек, не больше, лежит в листе дерева
+        '''
+
+        super().__init__()
+
+        self._names = list()
+        self._kinds = list()
+        coords = list()
+
+        # одна битая строка в большом наборе не должна мешать боту стартовать, пропускаем ее
+        for place in places:
+            point = _parse_point(place)
+            if point is None:
+                continue
+
+            self._names.append(place.get('name') or '')
+            self._kinds.append(place.get('kind') or '')
+            coords.append(point)
+
+        skipped = len(places) - len(coords)
+        if skipped > 0:
+            print('Skipped {} places with invalid coordinates'.format(skipped))
+
+        coords = np.array(coords, dtype=np.float64).reshape(-1, 2)
+        self._lats = np.radians(coords[:, 0])
+        self._lons = np.radians(coords[:, 1])
+        self._leaf_size = max(int(leaf_size), 1)
+
+        # узлы дерева: диапазон [начало, конец) в упорядоченных точках, дети и шапочка
+        self._lo = list()
+        self._hi = list()
+        self._children = list()
+        self._centers = list()
+        self._radii = list()
+
+        # точки в порядке дерева, так что точки одного узла идут подряд
+        self._order = np.zeros(0, dtype=np.int64)
+        self._xyz = np.zeros((0, 3), dtype=np.float64)
+
+        if len(self._names) > 0:
+            self._build()
+
+    def _add_node(self, lo, hi, xyz):
+        '''
+        Добавляет в дерево узел с шапочкой, накрывающей точки xyz
+        :param lo: начало диапазона
+        :param hi: конец диапазона
+        :param xyz: точки узла
+        :return: номер узла
+        '''
+
+        center = xyz.mean(axis=0)
+        norm = np.linalg.norm(center)
+        center = center / norm if norm > 0 else xyz[0]
+
+        cross = np.linalg.norm(np.cross(xyz, center), axis=1)
+        radius = np.arctan2(cross, xyz @ center).max()
+
+        self._lo.append(lo)
+        self._hi.append(hi)
+        self._children.append(None)
+        self._centers.append(tuple(center.tolist()))
+        self._radii.append(float(radius))
+        return len(self._lo) - 1
+
+    def _build(self):
+        '''
+        Строит KD-дерево, деля каждый узел пополам по медиане вдоль самой длинной стороны коробки
+        :return:
+        '''
+
+        xyz = _to_xyz(self._lats, self._lons)
+        order = np.arange(len(xyz))
+
+        stack = [self._add_node(0, len(order), xyz)]
+
+        while stack:
+            node = stack.pop()
+            lo, hi = self._lo[node], self._hi[node]
+
+            if hi - lo <= self._leaf_size:
+                continue
+
+            sub = order[lo:hi]
+            dim = int(np.argmax(np.ptp(xyz[sub], axis=0)))
+            mid = (lo + hi) // 2
+
+            order[lo:hi] = sub[np.argpartition(xyz[sub, dim], mid - lo)]
+
+            left = self._add_node(lo, mid, xyz[order[lo:mid]])
+            right = self._add_node(mid, hi, xyz[order[mid:hi]])
+            self._children[node] = (left, right)
+            stack.extend((left, right))
+
+        self._order = order
+        self._xyz = xyz[order]
+
+    def __len__(self):
+        return len(self._names)
+
+    @staticmethod
+    def load(file_name, leaf_size=32):
+        '''
+        Загружает места из CSV (колонки name, lat, lon, kind) или GeoJSON (точки)
+        :param file_name: имя файла
+        :param leaf_size: сколько точек, не больше, лежит в листе дерева
+        :return: индекс мест
+        '''
+
+        with open(file_name, 'r', encoding='utf-8') as f:
+            if file_name.lower().endswith(('.json', '.geojson')):
+                places = PlacesIndex._read_geojson(f)
+            else:
+                places = list(csv.DictReader(f))
+
+        return PlacesIndex(places, leaf_size=leaf_size)
+
+    @staticmethod
+    def _read_geojson(f):
+        '''
+        Читает точки из GeoJSON FeatureCollection
+        :param f: открытый файл
+        :return: список мест
+        '''
+
+        places = list()
+        for feature in json.load(f).get('features', []):
+            geometry = feature.get('geometry') or {}
+            if geometry.get('type') != 'Point':
+                continue
+
+            properties = feature.get('properties') or {}
+            coordinates = geometry.get('coordinates')
+
+            # битые координаты отсеет конструктор индекса
+            if isinstance(coordinates, (list, tuple)) and len(coordinates) >= 2:
+                lon, lat = coordinates[:2]
+            else:
+                lon, lat = None, None
+            places.append({
+                'name': properties.get('name', ''),
+                'kind': properties.get('kind', ''),
+                'lat': lat,
+                'lon': lon,
+            })
+
+        return places
+
+    def _bound(self, node, point):
+        '''
+        Нижняя граница угла от точки до любой точки узла
+        :param node: номер узла
+        :param point: точка (x, y, z)
+        :return: угол в радианах
+        '''
+
+        return max(_angle(point, self._centers[node]) - self._radii[node], 0.0)
+
+    def _search(self, point, k, max_angle=math.pi):
+        '''
+        Ищет k ближайших точек, обходя узлы от ближнего к дальнему
+        :param point: точка (x, y, z)
+        :param k: сколько точек нужно
+        :param max_angle: точки дальше этого угла не нужны вовсе
+        :return: позиции точек в порядке дерева
+        '''
+
+        vector = np.array(point)
+        best_d = np.zeros(0, dtype=np.float64)
+        best_i = np.zeros(0, dtype=np.int64)
+
+        # с запасом на погрешность округления, точно по радиусу отсекает nearest
+        worst = min(max_angle, math.pi) + 1e-12
+        max_chord = (2 * math.sin(worst / 2)) ** 2 if worst < math.pi else math.inf
+
+        heap = [(0.0, 0)]
+
+        while heap:
+            bound, node = heapq.heappop(heap)
+
+            # все оставшиеся узлы дальше уже найденной k-й точки
+            if bound > worst:
+                break
+
+            children = self._children[node]
+
+            if children is not None:
+                for child in children:
+                    d = self._bound(child, point)
+                    if d <= worst:
+                        heapq.heappush(heap, (d, child))
+                continue
+
+            # в листе считаем хорды, они монотонны по углу
+            lo, hi = self._lo[node], self._hi[node]
+            d = ((self._xyz[lo:hi] - vector) ** 2).sum(axis=1)
+            inside = d <= max_chord
+
+            best_d = np.concatenate([best_d, d[inside]])
+            best_i = np.concatenate([best_i, np.arange(lo, hi)[inside]])
+
+            if len(best_d) >= k:
+                keep = np.argpartition(best_d, k - 1)[:k]
+                best_d, best_i = best_d[keep], best_i[keep]
+
+                # угол до k-й точки, с запасом на погрешность округления
+                worst = 2 * math.asin(min(math.sqrt(best_d.max()) / 2, 1.0)) + 1e-12
+
+        return best_i
+
+    def nearest(self, lat, lon, k=3, radius=None):
+        '''
+        Ищет k ближайших к точке мест
+        :param lat: широта в градусах
+        :param lon: долгота в градусах
+        :param k: сколько мест вернуть
+        :param radius: места дальше этого расстояния в метрах не возвращаются, None -- без ограничения
+        :return: список словарей name, kind, lat, lon, distance (в метрах), от ближнего к дальнему
+        '''
+
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+
+        lat = np.radians(lat)
+        lon = np.radians(lon)
+
+        max_angle = math.pi if radius is None else radius / EARTH_RADIUS
+
+        found = self._order[self._search(tuple(_to_xyz(lat, lon).tolist()), k, max_angle=max_angle)]
+        distances = haversine(lat, lon, self._lats[found], self._lons[found])
+
+        best = np.argsort(distances)
+        if radius is not None:
+            best = best[distances[best] <= radius]
+
+        return [
+            {
+                'name': self._names[i],
+                'kind': self._kinds[i],
+                'lat': float(np.degrees(self._lats[i])),
+                'lon': float(np.degrees(self._lons[i])),
+                'distance': float(d),
+            }
+            for i, d in zip(found[best].tolist(), distances[best].tolist())
+        ]
@@ -1,3 +1,4 @@
+import os
 import telebot
 from dialog import Dialog
 
@@ -10,6 +11,8 @@ print('Start pooling...')
 
 dialog_instance = Dialog(bot, {
     'voc': 'voc.yaml',
+    # идентификаторы чатов, которым доступна команда /export, через запятую
+    'admins': [int(chat_id) for chat_id in os.environ.get('ADMINS', '').split(',') if chat_id.strip()],
 })
 
 dialog_instance.start()
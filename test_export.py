@@ -0,0 +1,232 @@
+import csv
+import json
+from types import SimpleNamespace
+
+import yaml
+import pytest
+
+import dialog
+from dialog import Dialog
+from export import export_sessions
+
+
+VOC = {
+    'nodes': {
+        'begin': {
+            'type': 'variant',
+            'reset': True,
+            'q': 'Начнем?',
+            'a': {'name': 'Да!', 'goto': 'q_loc', 'tags': 'started', 'save': 'start'},
+        },
+        'q_loc': {
+            'type': 'location',
+            'q': 'Где ты?',
+            'a': {'type': 'location', 'goto': 'q_name', 'save': 'location'},
+        },
+        'q_name': {
+            'type': 'plain',
+            'q': 'Как тебя зовут?',
+            'a': {'words': '*', 'goto': 'end', 'save': 'name'},
+        },
+        'end': {
+            'type': 'plain',
+            'q': 'Спасибо!',
+            'a': {'name': 'Заново', 'goto': 'begin'},
+        },
+    },
+    'answers_limit': 100,
+    'default': 'begin',
+    'wrong': 'Не понял',
+}
+
+
+class FakeBot(object):
+    '''
+    Бот, который ничего не отправляет, а только запоминает, что ему велели сказать
+    '''
+
+    def __init__(self):
+        self.sent = list()
+
+    def send_chat_action(self, chat_id, action):
+        pass
+
+    def send_message(self, chat_id, text=None, reply_markup=None):
+        self.sent.append((chat_id, text))
+
+    def send_photo(self, chat_id, photo=None, caption=None, reply_markup=None):
+        self.sent.append((chat_id, caption))
+
+
+def text(chat_id, value):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id), content_type='text', text=value, location=None)
+
+
+def location(chat_id, lat, lon):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id), content_type='location', text=None,
+                           location=SimpleNamespace(latitude=lat, longitude=lon))
+
+
+@pytest.fixture
+def make_dialog(tmp_path, monkeypatch):
+    # морфология в этих тестах не нужна, а словари pymorphy2 грузятся долго
+    monkeypatch.setattr(dialog.pymorphy2, 'MorphAnalyzer', lambda: None)
+
+    def make(voc=VOC):
+        voc_file = tmp_path / 'voc.yaml'
+        voc_file.write_text(yaml.safe_dump(voc, allow_unicode=True), encoding='utf-8')
+        return Dialog(FakeBot(), {'voc': str(voc_file)})
+
+    return make
+
+
+def play(the_dialog, chat_id, name, lat=-33.75, lon=151.2):
+    '''
+    Проходит весь опрос: кнопка, локация, имя
+    '''
+
+    the_dialog._dialog(text(chat_id, 'привет'))
+    the_dialog._dialog(text(chat_id, None), data='0')
+    the_dialog._dialog(location(chat_id, lat, lon))
+    the_dialog._dialog(text(chat_id, name))
+
+
+def read_exports(the_dialog, tmp_path):
+    csv_file = str(tmp_path / 'results.csv')
+    jsonl_file = str(tmp_path / 'results.jsonl')
+
+    export_sessions(the_dialog, csv_file, chunk_size=2)
+    export_sessions(the_dialog, jsonl_file, chunk_size=2)
+
+    with open(csv_file, encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    with open(jsonl_file, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+
+    return rows, records
+
+
+def test_answers_are_captured(make_dialog):
+    the_dialog = make_dialog()
+    play(the_dialog, 1, 'Вася')
+
+    assert the_dialog.get_session(1).answers == {
+        'start': 'Да!',
+        'location': '-33.750000,151.200000',
+        'name': 'Вася',
+    }
+
+
+def test_field_limit_is_shared_evenly(make_dialog):
+    the_dialog = make_dialog()
+
+    # три поля на 100 символов -- по 33 на поле
+    the_dialog.save_answer(1, 'name', 'x' * 80)
+    the_dialog.save_answer(1, 'location', 'y' * 80)
+
+    assert the_dialog.get_session(1).answers == {'name': 'x' * 33, 'location': 'y' * 33}
+
+
+def test_session_limit_is_a_backstop(make_dialog):
+    the_dialog = make_dialog()
+
+    the_dialog.save_answer(1, 'name', 'x' * 90, limit=90)
+    the_dialog.save_answer(1, 'location', 'y' * 80)
+
+    # перезапись поля не считает его старое значение
+    the_dialog.save_answer(1, 'name', 'z' * 90, limit=90)
+
+    answers = the_dialog.get_session(1).answers
+    assert answers['location'] == 'y' * 10
+    assert answers['name'] == 'z' * 90
+
+
+def test_reset_clears_answers(make_dialog):
+    the_dialog = make_dialog()
+    play(the_dialog, 1, 'Вася')
+
+    the_dialog._dialog(text(1, None), data='0')
+
+    assert the_dialog.get_session(1).answers is None
+
+
+@pytest.mark.parametrize('field', ['started', 'ts', 'chat_id', 'node_name'])
+def test_field_name_clash(make_dialog, field):
+    voc = json.loads(json.dumps(VOC))
+    voc['nodes']['q_name']['a']['save'] = field
+
+    with pytest.raises(ValueError):
+        make_dialog(voc)
+
+
+def test_csv_and_jsonl_records_match(make_dialog, tmp_path):
+    the_dialog = make_dialog()
+    play(the_dialog, 1, 'Вася')
+    play(the_dialog, 2, 'Петя', lat=55.75, lon=37.62)
+    the_dialog._dialog(text(3, 'привет'))
+
+    rows, records = read_exports(the_dialog, tmp_path)
+
+    assert len(rows) == len(records) == 3
+
+    for row, record in zip(rows, records):
+        flat = {'chat_id': record['chat_id'], 'node_name': record['node_name'], 'ts': record['ts']}
+        flat.update(record['tags'])
+        flat.update(record['answers'])
+
+        assert list(row) == list(flat)
+        assert row == {k: str(v) for k, v in flat.items()}
+
+    # ненаступившие теги -- нули, незаполненные поля -- пустые строки, в обоих форматах
+    assert records[2]['tags'] == {'started': 0}
+    assert records[2]['answers'] == {'start': '', 'location': '', 'name': ''}
+    assert rows[2]['started'] == '0'
+
+
+def test_negative_latitude_is_not_escaped(make_dialog, tmp_path):
+    the_dialog = make_dialog()
+    play(the_dialog, 1, 'Вася', lat=-33.75, lon=-70.5)
+
+    rows, records = read_exports(the_dialog, tmp_path)
+
+    assert rows[0]['location'] == '-33.750000,-70.500000'
+    assert records[0]['answers']['location'] == '-33.750000,-70.500000'
+
+
+@pytest.mark.parametrize('value', ['=HYPERLINK("http://evil")', '+7 999', '-1+2', '@SUM(A1)'])
+def test_formulas_are_escaped_in_csv(make_dialog, tmp_path, value):
+    the_dialog = make_dialog()
+    play(the_dialog, 1, value)
+
+    rows, records = read_exports(the_dialog, tmp_path)
+
+    assert rows[0]['name'] == "'" + value
+    assert records[0]['answers']['name'] == value
+
+
+def test_iter_sessions_pages_without_duplicates(make_dialog):
+    the_dialog = make_dialog()
+    for chat_id in range(25):
+        the_dialog.new_session(chat_id, node_name='q_name')
+
+    chunks = list(the_dialog.iter_sessions(chunk_size=10))
+
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert [sess['chat_id'] for chunk in chunks for sess in chunk] == list(range(25))
+
+
+def test_iter_sessions_includes_chats_added_mid_export(make_dialog):
+    the_dialog = make_dialog()
+    for chat_id in range(5):
+        the_dialog.new_session(chat_id, node_name='q_name')
+
+    chunks = the_dialog.iter_sessions(chunk_size=3)
+    seen = [sess['chat_id'] for sess in next(chunks)]
+
+    # новый чат и повторное создание сессии старого чата во время выгрузки
+    the_dialog.new_session(100, node_name='q_name')
+    the_dialog.new_session(1, node_name='begin')
+
+    seen.extend(sess['chat_id'] for chunk in chunks for sess in chunk)
+
+    assert seen == [0, 1, 2, 3, 4, 100]
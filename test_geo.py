@@ -0,0 +1,121 @@
+import json
+
+import numpy as np
+import pytest
+
+from geo import PlacesIndex, haversine
+
+
+def brute_force(lats, lons, lat, lon, k):
+    '''
+    Расстояния до k ближайших точек полным перебором
+    '''
+
+    distances = haversine(np.radians(lat), np.radians(lon), np.radians(lats), np.radians(lons))
+    return np.sort(distances)[:k]
+
+
+def make_index(lats, lons, leaf_size=32):
+    places = [
+        {'name': str(i), 'lat': a, 'lon': b}
+        for i, (a, b) in enumerate(zip(lats, lons))
+    ]
+    return PlacesIndex(places, leaf_size=leaf_size)
+
+
+@pytest.fixture(scope='module')
+def city():
+    rng = np.random.default_rng(42)
+    lats = 55.75 + rng.normal(0, 0.1, 20000)
+    lons = 37.6 + rng.normal(0, 0.15, 20000)
+    return lats, lons, make_index(lats, lons)
+
+
+@pytest.mark.parametrize('k', [1, 5, 20])
+def test_dense(city, k):
+    lats, lons, index = city
+    rng = np.random.default_rng(k)
+
+    for lat, lon in zip(55.75 + rng.normal(0, 0.15, 50), 37.6 + rng.normal(0, 0.2, 50)):
+        found = [p['distance'] for p in index.nearest(lat, lon, k=k)]
+        assert np.allclose(found, brute_force(lats, lons, lat, lon, k))
+
+
+@pytest.mark.parametrize('lat, lon', [(43.1, 131.9), (-33.9, 151.2), (90, 0), (-90, 0), (-55.75, -142.4)])
+def test_far_from_all_points(city, lat, lon):
+    lats, lons, index = city
+
+    found = [p['distance'] for p in index.nearest(lat, lon, k=5)]
+    assert np.allclose(found, brute_force(lats, lons, lat, lon, 5))
+
+
+def test_k_greater_than_size():
+    lats = np.array([55.7298, 55.7928, 55.7725])
+    lons = np.array([37.6011, 37.6775, 37.7683])
+    index = make_index(lats, lons, leaf_size=1)
+
+    found = index.nearest(55.75, 37.62, k=10)
+
+    assert len(found) == 3
+    assert np.allclose([p['distance'] for p in found], brute_force(lats, lons, 55.75, 37.62, 3))
+    assert found[0]['name'] == '0'
+
+
+@pytest.mark.parametrize('radius', [0, 500, 2000, 10000])
+def test_radius(city, radius):
+    lats, lons, index = city
+
+    expected = brute_force(lats, lons, 55.8, 37.65, 20)
+    expected = expected[expected <= radius]
+
+    found = [p['distance'] for p in index.nearest(55.8, 37.65, k=20, radius=radius)]
+    assert np.allclose(found, expected)
+
+
+def test_radius_far_from_all_points(city):
+    _, _, index = city
+
+    assert index.nearest(-33.9, 151.2, k=3, radius=20000) == []
+
+
+def test_invalid_rows_are_skipped(tmp_path, capsys):
+    csv_file = tmp_path / 'places.csv'
+    csv_file.write_text(
+        'name,lat,lon,kind\n'
+        'Парк,55.7298,37.6011,парк\n'
+        'Пусто,,37.6,парк\n'
+        'Буквы,abc,37.6,парк\n'
+        'Мимо,95,37.6,парк\n'
+        'Коротко,55.7\n',
+        encoding='utf-8'
+    )
+
+    index = PlacesIndex.load(str(csv_file))
+
+    assert len(index) == 1
+    assert index.nearest(55.75, 37.62)[0]['name'] == 'Парк'
+    assert 'Skipped 4' in capsys.readouterr().out
+
+
+def test_invalid_geojson_features_are_skipped(tmp_path):
+    features = [
+        {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [37.6011, 55.7298]},
+         'properties': {'name': 'Парк'}},
+        {'type': 'Feature', 'geometry': {'type': 'Point'}, 'properties': {'name': 'Без координат'}},
+        {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [37.6]}, 'properties': {}},
+        {'type': 'Feature', 'geometry': None, 'properties': {}},
+    ]
+    geojson_file = tmp_path / 'places.geojson'
+    geojson_file.write_text(json.dumps({'type': 'FeatureCollection', 'features': features}), encoding='utf-8')
+
+    index = PlacesIndex.load(str(geojson_file))
+
+    assert len(index) == 1
+    assert index.nearest(55.75, 37.62)[0]['name'] == 'Парк'
+
+
+def test_empty():
+    index = PlacesIndex([])
+
+    assert len(index) == 0
+    assert index.nearest(55.75, 37.62, k=3) == []